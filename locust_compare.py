@@ -10,51 +10,104 @@ Compare single column between two report files, based on a given threshold:
 Compare multiple columns between two report files, based on a given threshold:
   $ python locust_compare.py prefix_stats_previous.csv prefix_stats.csv --column-name 'Average Response Time;90%' --threshold 1
 """
+import numpy as np
 import pandas as pd
 import argparse
 import sys
-from jinja2 import Environment, FileSystemLoader
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 
 class LocustComparer:
 
-    def __init__(self, previous, current, threshold):
+    _template = None
+
+    def __init__(self, previous, current, threshold, columns):
         self._previous = previous
         self._current = current
         self._threshold = threshold
-        self._comparison_tables = []
+        self._columns = columns
+        self._ratios = {}
+
+        usecols = ['Type', 'Name', *columns]
+        dtype = {'Name': 'category', **{column: 'float64' for column in columns}}
+        new_df = pd.read_csv(current, usecols=usecols, dtype=dtype, memory_map=True)
+        old_df = pd.read_csv(previous, usecols=usecols, dtype=dtype, memory_map=True)
+
+        # Share the categories so the alignment can match on the integer codes
+        categories = new_df['Name'].cat.categories.union(old_df['Name'].cat.categories)
+        new_df['Name'] = new_df['Name'].cat.set_categories(categories)
+        old_df['Name'] = old_df['Name'].cat.set_categories(categories)
+
+        # Align both reports on their (Type, Name) index once, endpoints missing from one side become NaN
+        new_df, old_df = new_df.set_index(['Type', 'Name']).align(old_df.set_index(['Type', 'Name']), join='outer')
+
+        # Only the keys are needed as a frame (for display), the values are kept as plain arrays
+        self._keys = new_df.index.to_frame(index=False)
+        self._values = {column: (new_df[column].to_numpy(), old_df[column].to_numpy()) for column in columns}
+
+    def _compare(self, column_name, out):
+        new_values, old_values = self._values[column_name]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(new_values, old_values, out=out)
+
+    def _comparison_tables(self):
+        for column_name, results in self._ratios.items():
+            new_values, old_values = self._values[column_name]
+            compared_columns = self._keys.assign(**{
+                f'{column_name}_new': new_values,
+                f'{column_name}_old': old_values,
+                'Results': results,
+            })
 
-    def compare(self, column_name):
-        new_df = pd.read_csv(self._current)
-        old_df = pd.read_csv(self._previous)
+            yield column_name, compared_columns
 
-        merged_df = pd.merge(new_df, old_df, on=['Type', 'Name'], how='outer', suffixes=('_new', '_old'))
-        compared_columns = merged_df[['Type', 'Name', f'{column_name}_new', f'{column_name}_old']]
-        results = compared_columns[f'{column_name}_new'] / compared_columns[f'{column_name}_old']
+    def compare(self):
+        # One buffer for all ratios, column-major so every column is a contiguous slice
+        ratios = np.empty((len(self._keys), len(self._columns)), order='F')
 
-        compared_columns.insert(len(compared_columns.columns), 'Results', results)
-        self._comparison_tables.append(dict(title=column_name, body=compared_columns.to_html()))
+        # Columns are independent once aligned, so compare them concurrently
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(self._compare, self._columns, ratios.T))
 
-        print(f'Comparison for {column_name} column:\n {compared_columns.to_string()}\n\n')
+        self._ratios = dict(zip(self._columns, ratios.T))
 
-        return results.add_prefix(f'({column_name})_')
+        return ratios.ravel(order='F')
+
+    def print_comparison(self):
+        for column_name, compared_columns in self._comparison_tables():
+            print(f'Comparison for {column_name} column:\n ', end='')
+            compared_columns.to_string(buf=sys.stdout)
+            print('\n\n')
+
+    @classmethod
+    def _get_template(cls):
+        if cls._template is None:
+            env = Environment(loader=FileSystemLoader('.'), auto_reload=False, bytecode_cache=FileSystemBytecodeCache())
+            cls._template = env.get_template("comparison-template.html")
+
+        return cls._template
 
     def render_report(self, output_file):
-        template = Environment(loader=FileSystemLoader('.')).get_template("comparison-template.html")
-        html = template.render(tables=self._comparison_tables)
-        html_file = open(output_file, "w")
-        html_file.write(html)
-        html_file.close()
+        template = self._get_template()
+        tables = [dict(title=title, body=table.to_html(index=False)) for title, table in self._comparison_tables()]
+
+        with open(output_file, "w") as html_file:
+            template.stream(tables=tables).dump(html_file)
 
     def validate(self, results):
         print(f'Threshold factor: {self._threshold}\n')
 
-        if all(result <= self._threshold for result in results.array):
-            sys.exit()
-        elif any(result > self._threshold for result in results.array):
-            sys.exit('Some of the requests are above the given threshold factor!')
+        # max propagates NaN, so a single reduction covers the passing case
+        if np.max(results, initial=-np.inf) <= self._threshold:
+            sys.exit(0)
+        elif np.fmax.reduce(results, initial=-np.inf) > self._threshold:
+            print('Some of the requests are above the given threshold factor!', file=sys.stderr)
         else:
-            sys.exit('An error occurred!')
+            print('An error occurred!', file=sys.stderr)
+
+        sys.exit(1)
 
 
 def main():
@@ -95,13 +148,20 @@ def main():
         help='HTML report file name (default: %(default)s).'
     )
 
+    parser.add_argument(
+        '-q', '--quiet',
+        action='store_true',
+        help='Do not print the comparison tables to stdout.'
+    )
+
     args = parser.parse_args()
 
-    comparer = LocustComparer(args.previous, args.current, args.threshold)
-    results = pd.Series([], dtype=float)
+    columns = args.column_name.split(';')
+    comparer = LocustComparer(args.previous, args.current, args.threshold, columns)
+    results = comparer.compare()
 
-    for column in args.column_name.split(';'):
-        results = results.append(comparer.compare(column))
+    if not args.quiet:
+        comparer.print_comparison()
 
     comparer.render_report(args.output)
 